@@ -1,8 +1,10 @@
+import functools
 import math
 import pygame
 from pygame.locals import DOUBLEBUF, OPENGL, QUIT
 from OpenGL.GL import *
 from OpenGL.GLU import *
+from OpenGL.arrays import vbo
 import numpy as np
 from maps import map2
 
@@ -37,33 +39,78 @@ edges = [
     (0, 4), (1, 5), (2, 6), (3, 7)
 ]
 
-def draw_cube_outline(size=1.0):
-    """Draw just the black outline of a cube with given edge length."""
-    glColor3f(0.0, 0.0, 0.0)  # black
-    glLineWidth(2.0)
+# the same geometry as arrays, so a whole cube (or lane of cubes) is indexed and scaled in one go
+VERTS = np.array(vertices, dtype=np.float32)
+FACE_IDX = np.array(faces, dtype=np.uint32)
+EDGE_IDX = np.array(edges, dtype=np.uint32)
+# each quad face split into 2 triangles, for indexed drawing
+TRI_IDX = FACE_IDX[:, [0, 1, 2, 0, 2, 3]]
+
+CUBE_COLOR = (0.2, 0.8, 0.3)  # mono green-ish
+OUTLINE_COLOR = (0.0, 0.0, 0.0)  # black
+# outlines are drawn slightly larger than the cube to avoid z-fighting
+OUTLINE_SCALE = 1.01
+
+# interleaved (x, y, z, r, g, b) float32 vertices: 24 byte stride, color 12 bytes in
+VERTEX_STRIDE = 6 * 4
+COLOR_OFFSET = 3 * 4
+
+def interleave_colors(positions, color):
+    """Return an (N, 6) float32 array of each (N, 3) position followed by the shared color."""
+    colors = np.broadcast_to(np.asarray(color, dtype=np.float32), positions.shape)
+    return np.ascontiguousarray(np.hstack([positions, colors]), dtype=np.float32)
+
+def draw_cube_faces(size=1.0):
+    """Draw the faces of a cube with given edge length, in the current color."""
+    glBegin(GL_QUADS)
+    for v in VERTS[FACE_IDX.ravel()] * size:
+        glVertex3fv(v)
+    glEnd()
 
+def draw_cube_edges(size=1.0):
+    """Draw the edges of a cube with given edge length, in the current color and line width."""
     glBegin(GL_LINES)
-    for e in edges:
-        for idx in e:
-            vx, vy, vz = vertices[idx]
-            glVertex3f(vx * size, vy * size, vz * size)
+    for v in VERTS[EDGE_IDX.ravel()] * size:
+        glVertex3fv(v)
     glEnd()
 
+def draw_cube_outline(size=1.0):
+    """Draw just the black outline of a cube with given edge length."""
+    glColor3f(*OUTLINE_COLOR)
+    glLineWidth(2.0)
+    draw_cube_edges(size)
+
 def draw_colored_cube_with_outline(color, size=1.0):
     """Draw a solid-colored cube with a black outline."""
     # solid faces
     glColor3f(*color)
-    glBegin(GL_QUADS)
-    for face in faces:
-        for idx in face:
-            vx, vy, vz = vertices[idx]
-            glVertex3f(vx * size, vy * size, vz * size)
-    glEnd()
+    draw_cube_faces(size)
 
     # outline - slightly larger to avoid z-fighting
-    outline_size = size * 1.01
+    outline_size = size * OUTLINE_SCALE
     draw_cube_outline(outline_size)
 
+# compiled (faces, outline) display lists, keyed by size
+_CUBE_LISTS = {}
+
+def cube_display_lists(size=1.0):
+    """
+    Return (face_list, outline_list): display lists of just the geometry of a cube's faces and outline.
+    Color and line width are left to the caller, so a whole pass of cubes shares one state change.
+    Recorded once per size and replayed with glCallList.
+    """
+    if size not in _CUBE_LISTS:
+        face_list = glGenLists(2)
+        outline_list = face_list + 1
+        glNewList(face_list, GL_COMPILE)
+        draw_cube_faces(size)
+        glEndList()
+        glNewList(outline_list, GL_COMPILE)
+        draw_cube_edges(size * OUTLINE_SCALE)
+        glEndList()
+        _CUBE_LISTS[size] = (face_list, outline_list)
+    return _CUBE_LISTS[size]
+
 
 # ------------------ Lane rendering ------------------
 
@@ -76,43 +123,311 @@ def draw_lane_from_slices(slices, cube_size=1.0, spacing=1.0):
     if not slices:
         return
 
-    num_slices = len(slices)
-    rows, cols = slices[0].shape
+    face_list, outline_list = cube_display_lists(cube_size)
+    centers = lane_centers(slices, cube_size, spacing)
+
+    # every cube's faces, then every cube's outline, so color and line state change once per pass
+    glColor3f(*CUBE_COLOR)
+    for x, y, z in centers:
+        glPushMatrix()
+        glTranslatef(x, y, z)
+        glCallList(face_list)
+        glPopMatrix()
+
+    glColor3f(*OUTLINE_COLOR)
+    glLineWidth(2.0)
+    for x, y, z in centers:
+        glPushMatrix()
+        glTranslatef(x, y, z)
+        glCallList(outline_list)
+        glPopMatrix()
+
+# lane_centers results, keyed by (id(slices), cube_size, spacing) -> (slices, centers)
+_CENTERS_CACHE = {}
+
+def lane_centers(slices, cube_size=1.0, spacing=1.0):
+    """
+    Return the (x, y, z) center of every filled voxel as a float32 array of shape (M, 3).
+    slices: list of 3x3 numpy arrays with 0/1 values, laid out as in draw_lane_from_slices.
+    Results are cached per slices list, which must not be modified afterwards.
+    """
+    key = (id(slices), cube_size, spacing)
+    cached = _CENTERS_CACHE.get(key)
+    # the lane is static, so a given map only ever needs this once
+    if cached is not None and cached[0] is slices:
+        return cached[1]
+
+    arr = np.asarray(slices)
+    num_slices, rows, cols = arr.shape
 
     step = cube_size + spacing
     x_offset = - (num_slices - 1) * step / 2.0
     y_offset = - (rows - 1) * cube_size / 2.0
     z_offset = - (cols - 1) * cube_size / 2.0
 
-    for i, grid in enumerate(slices):
-        x = x_offset + i * step
+    # slice, row and column index of every filled voxel, in slice order
+    ii, rr, cc = np.nonzero(arr == 1)
+    xs = x_offset + ii * step
+    ys = y_offset + (rows - 1 - rr) * cube_size
+    zs = z_offset + cc * cube_size
+    centers = np.stack([xs, ys, zs], axis=1).astype(np.float32)
+
+    _CENTERS_CACHE[key] = (slices, centers)
+    return centers
+
+def lane_slice_bounds(slices, cube_size=1.0, spacing=1.0):
+    """
+    Return (corners, starts) for culling whole slices, laid out as in draw_lane_from_slices.
+        corners: (N, 8, 4) homogeneous corners of each slice's bounding box, outlines included
+        starts: (N + 1,) index of each slice's first cube in lane_centers order, then the cube total
+    """
+    arr = np.asarray(slices)
+    num_slices, rows, cols = arr.shape
+
+    step = cube_size + spacing
+    x_offset = - (num_slices - 1) * step / 2.0
+    xs = x_offset + np.arange(num_slices) * step
 
-        for r in range(rows):
-            for c in range(cols):
-                if grid[r, c] == 1:
-                    y = y_offset + (rows - 1 - r) * cube_size
-                    z = z_offset + c * cube_size
+    # the cross-section is centered on y = z = 0, so each box is centered on (x, 0, 0)
+    half_extents = 0.5 * OUTLINE_SCALE * cube_size * np.array([1, rows, cols])
+    box = 2 * VERTS * half_extents
+    corners = np.ones((num_slices, 8, 4), dtype=np.float32)
+    corners[:, :, :3] = box
+    corners[:, :, 0] += xs[:, None]
 
-                    glPushMatrix()
-                    glTranslatef(x, y, z)
+    counts = (arr == 1).sum(axis=(1, 2))
+    starts = np.concatenate([[0], np.cumsum(counts)])
+    return corners, starts
 
-                    color = (0.2, 0.8, 0.3)  # mono green-ish
-                    draw_colored_cube_with_outline(color, cube_size)
-                    glPopMatrix()
+def build_lane_vbo(slices, cube_size=1.0, spacing=1.0):
+    """
+    Build the whole lane as two vertex buffers, once, instead of drawing cube by cube.
+    Uses the same layout as draw_lane_from_slices.
+    Returns (face_vbo, face_count, edge_vbo, edge_count), both buffers interleaved (x, y, z, r, g, b):
+        face_vbo: every face quad of every filled voxel (GL_QUADS)
+        edge_vbo: every outline edge of every filled voxel (GL_LINES)
+    """
+    centers = lane_centers(slices, cube_size, spacing)
 
-# ------------------ OpenGL / Pygame setup ------------------
+    # per-cube corner positions gathered into quads (6 faces * 4) and lines (12 edges * 2)
+    face_verts = VERTS[FACE_IDX.ravel()] * cube_size
+    edge_verts = VERTS[EDGE_IDX.ravel()] * cube_size * OUTLINE_SCALE
 
-def init_pygame_opengl(num_slices, width=800, height=600, cube_size=1.0, spacing=1.0):
-    pygame.init()
-    pygame.display.set_mode((width, height), DOUBLEBUF | OPENGL)
+    face_arr = interleave_colors((centers[:, None, :] + face_verts).reshape(-1, 3), CUBE_COLOR)
+    edge_arr = interleave_colors((centers[:, None, :] + edge_verts).reshape(-1, 3), OUTLINE_COLOR)
 
-    glEnable(GL_DEPTH_TEST)
-    glClearColor(0.05, 0.05, 0.05, 1.0)
-    glDisable(GL_LIGHTING)
+    return vbo.VBO(face_arr), len(face_arr), vbo.VBO(edge_arr), len(edge_arr)
 
+def draw_lane_vbo(face_vbo, face_count, edge_vbo, edge_count, cubes=None):
+    """
+    Draw a lane built by build_lane_vbo: one draw call for faces, one for outlines.
+    cubes: optional (first, count) range of cubes to draw, in lane_centers order. Draws all if None.
+    """
+    # every cube is 24 face vertices and 24 edge vertices
+    first, count = cubes if cubes is not None else (0, face_count // 24)
+
+    glEnableClientState(GL_VERTEX_ARRAY)
+    glEnableClientState(GL_COLOR_ARRAY)
+
+    # solid faces
+    face_vbo.bind()
+    glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, face_vbo)
+    glColorPointer(3, GL_FLOAT, VERTEX_STRIDE, face_vbo + COLOR_OFFSET)
+    glDrawArrays(GL_QUADS, first * 24, count * 24)
+    face_vbo.unbind()
+
+    # outlines
+    glLineWidth(2.0)
+    edge_vbo.bind()
+    glVertexPointer(3, GL_FLOAT, VERTEX_STRIDE, edge_vbo)
+    glColorPointer(3, GL_FLOAT, VERTEX_STRIDE, edge_vbo + COLOR_OFFSET)
+    glDrawArrays(GL_LINES, first * 24, count * 24)
+    edge_vbo.unbind()
+
+    glDisableClientState(GL_COLOR_ARRAY)
+    glDisableClientState(GL_VERTEX_ARRAY)
+
+# ------------------ Instanced rendering ------------------
+
+# one cube mesh, moved to each voxel center by a per-instance offset
+VERTEX_SHADER = """
+#version 330
+layout(location = 0) in vec3 pos;
+layout(location = 1) in vec3 offset;
+layout(location = 2) in vec3 color;
+uniform mat4 mvp;
+out vec3 v_color;
+void main() {
+    gl_Position = mvp * vec4(pos + offset, 1.0);
+    v_color = color;
+}
+"""
+
+FRAGMENT_SHADER = """
+#version 330
+in vec3 v_color;
+out vec4 frag_color;
+void main() {
+    frag_color = vec4(v_color, 1.0);
+}
+"""
+
+def compile_shader_program(vertex_src, fragment_src):
+    """Compile and link a vertex + fragment shader pair, returning the program id."""
+    program = glCreateProgram()
+    for shader_type, src in ((GL_VERTEX_SHADER, vertex_src), (GL_FRAGMENT_SHADER, fragment_src)):
+        shader = glCreateShader(shader_type)
+        glShaderSource(shader, src)
+        glCompileShader(shader)
+        if not glGetShaderiv(shader, GL_COMPILE_STATUS):
+            raise RuntimeError(f"Shader compile failed: {glGetShaderInfoLog(shader).decode()}")
+        glAttachShader(program, shader)
+        # only flagged for deletion, freed along with the program
+        glDeleteShader(shader)
+    glLinkProgram(program)
+    if not glGetProgramiv(program, GL_LINK_STATUS):
+        raise RuntimeError(f"Shader link failed: {glGetProgramInfoLog(program).decode()}")
+    return program
+
+def build_lane_instances(slices, cube_size=1.0, spacing=1.0):
+    """
+    Build the buffers to draw the lane with instancing: one cube mesh plus one offset per filled voxel.
+    The meshes are the cube's 8 unique corners, interleaved (x, y, z, r, g, b), drawn through index
+    buffers so each corner is only transformed once per cube.
+    Returns (cube_vbo, tri_ibo, edge_vbo, line_ibo, offsets_vbo, num_cubes)
+    """
+    cube_arr = interleave_colors(VERTS * cube_size, CUBE_COLOR)
+    edge_arr = interleave_colors(VERTS * cube_size * OUTLINE_SCALE, OUTLINE_COLOR)
+    tri_ibo = vbo.VBO(np.ascontiguousarray(TRI_IDX.ravel()), target=GL_ELEMENT_ARRAY_BUFFER)
+    line_ibo = vbo.VBO(np.ascontiguousarray(EDGE_IDX.ravel()), target=GL_ELEMENT_ARRAY_BUFFER)
+    centers = lane_centers(slices, cube_size, spacing)
+    return vbo.VBO(cube_arr), tri_ibo, vbo.VBO(edge_arr), line_ibo, vbo.VBO(centers), len(centers)
+
+def current_mvp():
+    """Return the projection * modelview matrix of the fixed-function stacks, for the shader."""
+    modelview = glGetFloatv(GL_MODELVIEW_MATRIX)
+    projection = glGetFloatv(GL_PROJECTION_MATRIX)
+    # GL matrices are column-major, so numpy sees them transposed: (P * M)^T = M^T * P^T
+    return np.ascontiguousarray(modelview @ projection, dtype=np.float32)
+
+def draw_lane_instanced(program, mvp_loc, mvp, cube_vbo, tri_ibo, edge_vbo, line_ibo, offsets_vbo, num_cubes,
+                        cubes=None):
+    """
+    Draw a lane built by build_lane_instances: one instanced draw call for faces, one for outlines.
+    mvp_loc: location of the program's "mvp" uniform, looked up once by the caller.
+    cubes: optional (first, count) range of cubes to draw, in lane_centers order. Draws all if None.
+    """
+    first, count = cubes if cubes is not None else (0, num_cubes)
+
+    glUseProgram(program)
+    glUniformMatrix4fv(mvp_loc, 1, GL_FALSE, mvp)
+
+    # voxel centers, advanced once per cube instead of once per vertex.
+    # starting the pointer at the first center (3 float32 each) skips the rest without needing GL 4.2
+    offsets_vbo.bind()
+    glEnableVertexAttribArray(1)
+    glVertexAttribPointer(1, 3, GL_FLOAT, GL_FALSE, 0, offsets_vbo + first * 3 * 4)
+    glVertexAttribDivisor(1, 1)
+    offsets_vbo.unbind()
+
+    glEnableVertexAttribArray(0)
+    glEnableVertexAttribArray(2)
+
+    # solid faces
+    cube_vbo.bind()
+    tri_ibo.bind()
+    glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, cube_vbo)
+    glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, cube_vbo + COLOR_OFFSET)
+    glDrawElementsInstanced(GL_TRIANGLES, TRI_IDX.size, GL_UNSIGNED_INT, None, count)
+    tri_ibo.unbind()
+    cube_vbo.unbind()
+
+    # outlines
+    glLineWidth(2.0)
+    edge_vbo.bind()
+    line_ibo.bind()
+    glVertexAttribPointer(0, 3, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, edge_vbo)
+    glVertexAttribPointer(2, 3, GL_FLOAT, GL_FALSE, VERTEX_STRIDE, edge_vbo + COLOR_OFFSET)
+    glDrawElementsInstanced(GL_LINES, EDGE_IDX.size, GL_UNSIGNED_INT, None, count)
+    line_ibo.unbind()
+    edge_vbo.unbind()
+
+    glDisableVertexAttribArray(0)
+    # back to per-vertex, so the instancing divisor doesn't leak into later draws
+    glVertexAttribDivisor(1, 0)
+    glDisableVertexAttribArray(1)
+    glDisableVertexAttribArray(2)
+    glUseProgram(0)
+
+# ------------------ Lane geometry ------------------
+
+class LaneGeometry:
+    """
+    GPU buffers for a static lane, built once by build_lane_geometry and drawn every frame.
+    Must be created after init_pygame_opengl, since it caches the camera matrix set up there.
+    """
+    def __init__(self, program, buffers, slice_bounds):
+        # instancing shader program, or None to draw the batched VBOs with the fixed pipeline
+        self.program = program
+        self.buffers = buffers
+        # (corners, starts) from lane_slice_bounds, for skipping slices outside the view
+        self.slice_corners, self.slice_starts = slice_bounds
+        # camera matrix as numpy sees it (GL's column-major, i.e. transposed), so translation is row 3
+        if program is not None:
+            self.mvp_loc = glGetUniformLocation(program, "mvp")
+            self.base_matrix = current_mvp()
+        else:
+            self.base_matrix = np.array(glGetFloatv(GL_MODELVIEW_MATRIX), dtype=np.float32)
+        self.matrix = self.base_matrix.copy()
+
+    def visible_cubes(self):
+        """
+        Return the (first, count) range of cubes in slices that can be on screen with the current matrix.
+        A slice is skipped when its whole bounding box is outside one plane of the view frustum.
+        """
+        # both paths' matrices go all the way to clip space, where the frustum is -w <= x, y, z <= w
+        clip = self.slice_corners @ self.matrix
+        xyz, w = clip[..., :3], clip[..., 3:]
+        outside = ((xyz < -w).all(axis=1) | (xyz > w).all(axis=1)).any(axis=1)
+        visible = np.flatnonzero(~outside)
+        if len(visible) == 0:
+            return 0, 0
+        # the lane is straight, so the visible slices are one contiguous run
+        first = int(self.slice_starts[visible[0]])
+        return first, int(self.slice_starts[visible[-1] + 1]) - first
+
+    def draw(self, lane_x_offset=0.0):
+        """Draw the lane moved lane_x_offset along -X (two draw calls), skipping off-screen slices."""
+        # same as glTranslatef(-lane_x_offset, 0, 0) on the camera matrix, without the matrix stack
+        self.matrix[3] = self.base_matrix[3] - lane_x_offset * self.base_matrix[0]
+        cubes = self.visible_cubes()
+        if self.program is not None:
+            draw_lane_instanced(self.program, self.mvp_loc, self.matrix, *self.buffers, cubes=cubes)
+        else:
+            glMatrixMode(GL_MODELVIEW)
+            glLoadMatrixf(self.matrix)
+            draw_lane_vbo(*self.buffers, cubes=cubes)
+
+def build_lane_geometry(slices, cube_size=1.0, spacing=1.0, program=None):
+    """
+    Build all lane geometry up front so the render loop does no per-slice work.
+    program: shader program from init_pygame_opengl. Uses instancing if given, batched VBOs if None.
+    """
+    slice_bounds = lane_slice_bounds(slices, cube_size, spacing)
+    if program is not None:
+        return LaneGeometry(program, build_lane_instances(slices, cube_size, spacing), slice_bounds)
+    return LaneGeometry(None, build_lane_vbo(slices, cube_size, spacing), slice_bounds)
+
+# ------------------ OpenGL / Pygame setup ------------------
+
+@functools.lru_cache
+def _make_projection(num_slices, width=800, height=600, cube_size=1.0, spacing=1.0):
+    """
+    Return (fov, aspect, distance) for a camera that fits the whole lane on screen.
+    Pure math, so repeated setups (e.g. env resets) reuse the cached result.
+    """
     fov = 60.0
     aspect = width / float(height)
-    gluPerspective(fov, aspect, 0.1, 2000.0)
 
     # --- compute a reasonable camera distance based on cube size & lane length ---
     lane_length = (num_slices - 1) * (cube_size + spacing) + cube_size
@@ -124,12 +439,51 @@ def init_pygame_opengl(num_slices, width=800, height=600, cube_size=1.0, spacing
     distance = half_diag / math.tan(math.radians(fov / 2.0))
     # add a bit of margin so it's not hugging the screen
     distance += 2 * cube_size
+    return fov, aspect, distance
+
+def _apply_to_current_context(fov, aspect, distance):
+    """Set up render state and the camera matrix in the current GL context."""
+    glEnable(GL_DEPTH_TEST)
+    glClearColor(0.05, 0.05, 0.05, 1.0)
+    glDisable(GL_LIGHTING)
+
+    # start from a clean matrix so repeated setups don't stack cameras
+    glMatrixMode(GL_MODELVIEW)
+    glLoadIdentity()
+    gluPerspective(fov, aspect, 0.1, 2000.0)
     # move the world away from the camera
     glTranslatef(0.0, 0.0, -distance)
     # rotate the world to the correct orientation
     glRotatef(5, 1, 0, 0)
     glRotatef(90, 0, 1, 0)
 
+# (window size, shader program) of the display opened by init_pygame_opengl, reused on re-entry
+_DISPLAY = None
+
+def init_pygame_opengl(num_slices, width=800, height=600, cube_size=1.0, spacing=1.0):
+    """
+    Open the window and set up the camera.
+    An open window of the same size is reused, along with its shader program, instead of
+    recreating the display and recompiling, so repeated setups (e.g. env resets) are cheap.
+    Returns the instancing shader program, or None if the context can't run GLSL 3.30.
+    """
+    global _DISPLAY
+    surface = pygame.display.get_surface()
+    if surface is None or _DISPLAY is None or _DISPLAY[0] != (width, height):
+        if surface is not None and _DISPLAY is not None and _DISPLAY[1] is not None:
+            # free the old program while its context is still current
+            glDeleteProgram(_DISPLAY[1])
+        pygame.init()
+        pygame.display.set_mode((width, height), DOUBLEBUF | OPENGL)
+        try:
+            program = compile_shader_program(VERTEX_SHADER, FRAGMENT_SHADER)
+        except RuntimeError:
+            program = None
+        _DISPLAY = ((width, height), program)
+
+    _apply_to_current_context(*_make_projection(num_slices, width, height, cube_size, spacing))
+    return _DISPLAY[1]
+
 
 # ------------------ Main loop ------------------
 
@@ -138,13 +492,16 @@ def main():
     cube_size = 2.0
     spacing = 10.0  # how far apart slices are
 
-    init_pygame_opengl(
+    program = init_pygame_opengl(
         num_slices=len(slices),
         width=800,
         height=600,
         cube_size=cube_size,
         spacing=spacing)
 
+    # the lane never changes, so build its geometry once
+    scene = build_lane_geometry(slices, cube_size, spacing, program)
+
     running = True
     clock = pygame.time.Clock()
 
@@ -169,11 +526,8 @@ def main():
 
         glClear(GL_COLOR_BUFFER_BIT | GL_DEPTH_BUFFER_BIT)
 
-        glPushMatrix()
         # move entire lane along -X (toward camera)
-        glTranslatef(-lane_x_offset, 0.0, 0.0)
-        draw_lane_from_slices(slices, cube_size, spacing)
-        glPopMatrix()
+        scene.draw(lane_x_offset)
 
         pygame.display.flip()
 
@@ -2,9 +2,11 @@
 Brainstorming how States and Actions would work
 """
 
+from collections import deque
 from enum import Enum
 from typing import Self
 import numpy as np
+import play_fast
 from maps import map1, map2
 
 def main():
@@ -35,19 +37,19 @@ def main():
 
 
 START_LOCATION = (1,1)
-GAME_MAP: list[np.ndarray] | None = None
+GAME_MAP: deque[np.ndarray] | None = None
 def INIT_GAME(game_map: list[np.ndarray]) -> None:
-    """Initialize the game board as a list of grids"""
+    """Initialize the game board as a queue of grids"""
     global GAME_MAP
-    GAME_MAP = game_map
+    GAME_MAP = deque(game_map)
 
-def NEXT_GRID(drop:bool=True) -> list[np.ndarray] | None:
+def NEXT_GRID(drop:bool=True) -> np.ndarray | None:
     """Get the next grid in the gameboard, and (optionally) remove it from the remaining map"""
     assert GAME_MAP is not None, "Game map has not been initialized. Call INIT_GAME first."
     if len(GAME_MAP) == 0:
         return None
     if drop:
-        return GAME_MAP.pop(0)
+        return GAME_MAP.popleft()
     return GAME_MAP[0]
 
 def game_over(total_reward:int, total_moves:int):
@@ -60,17 +62,10 @@ def game_over(total_reward:int, total_moves:int):
 
 def str_to_action(move:str):
     "Given a move (l, r, j, d, s), return an Action"
-    actions = {
-        "l": Action.LEFT,
-        "r": Action.RIGHT,
-        "j": Action.JUMP,
-        "d": Action.DUCK,
-        "s": Action.STAY
-    }
     move = move.lower()
-    if move not in actions:
-        raise KeyError(f"Chosen move not in accepted moves: {list(actions.keys())}")
-    return actions[move]
+    if move not in _ACTION_TABLE:
+        raise KeyError(f"Chosen move not in accepted moves: {list(_ACTION_TABLE.keys())}")
+    return _ACTION_TABLE[move]
 
 class Action(Enum):
     # actions defined as (delta row, delta col) of grid
@@ -80,11 +75,26 @@ class Action(Enum):
     DUCK = (1,0)
     STAY = (0,0)
 
+# move letter -> Action, for str_to_action
+_ACTION_TABLE = {
+    "l": Action.LEFT,
+    "r": Action.RIGHT,
+    "j": Action.JUMP,
+    "d": Action.DUCK,
+    "s": Action.STAY
+}
 
 class State:
-    def __init__(self, grids:list[np.ndarray], player_location:tuple[int,int]):
+    def __init__(self, grids:list[np.ndarray], player_location:tuple[int,int], grid_bits:list[int | None] | None = None):
+        """
+        grid_bits: the grids already packed with play_fast.grid_bits, if known. Packed here otherwise.
+        """
         self.grids:list[np.ndarray] = grids
         self.player_location:tuple[int,int] = player_location
+        # grids packed as bitmasks for fast collision checks
+        if grid_bits is None:
+            grid_bits = [None if grid is None else play_fast.grid_bits(grid) for grid in grids]
+        self.grid_bits:list[int | None] = grid_bits
 
     def move(self, action:Action) -> tuple[int, Self | None]:
         """
@@ -109,30 +119,18 @@ class State:
         # handle last state
         if new_grids is None or all(grid is None for grid in new_grids):
             return reward, None
-        return reward, State(new_grids, new_location)
+        # the current second grid is already packed, so only pack the newly revealed one
+        new_bits = [self.grid_bits[1], None if new_grids[1] is None else play_fast.grid_bits(new_grids[1])]
+        return reward, State(new_grids, new_location, new_bits)
 
     def get_reward(self, action:Action) -> int:
         """
         Given an action in the current state, return the resulting reward (0, 1, or 2).
         Note: this currently only works assuming there are exactly 2 grids per state
         """
-        new_location = self._update_location(self.player_location, action)
-        # action results in immediate death --> no reward
-        if self._collides(new_location, self.grids[0]):
-            return 0
-        # at least one state survivable
-        total_reward = 1
-        current_location = new_location
-        # handle final grid of map
-        if self.grids[1] is None:
-            return total_reward
-        
-        for move in list(Action):
-            new_location = self._update_location(current_location, move)
-            # action results in survival --> return 2
-            if not self._collides(new_location, self.grids[1]):
-                return total_reward + 1
-        return total_reward
+        row, col = self.player_location
+        row_change, col_change = action.value
+        return play_fast.get_reward(self.grid_bits[0], self.grid_bits[1], row, col, row_change, col_change)
 
     def _update_location(self, player_location:tuple[int,int], action:Action):
         """
@@ -141,25 +139,7 @@ class State:
         """
         row, col = player_location
         row_change, col_change = action.value
-        # update the row and column, making sure they stay in bounds of 0 and 2
-        new_row = max(0, row + row_change)
-        new_row = min(new_row, 2)
-        new_col = max(0, col + col_change)
-        new_col = min(new_col, 2)
-        return (new_row, new_col)
-
-
-    def _collides(self, player_location:tuple[int,int], grid:np.ndarray) -> bool:
-        row, col = player_location
-        if grid[row, col] == 1:
-            return True
-        # If the player is standing (not ducking or jumping), their height is 2 -> check both points
-        # A player is standing if their location row is 1. (jumping if 0, ducking if 2)
-        mid_row = 1
-        bot_row = 2
-        if row == mid_row and grid[bot_row, col] == 1:
-            return True
-        return False
+        return play_fast.update_loc(row, col, row_change, col_change)
     
     def __str__(self):
         return "="*50 + f"Location: {self.player_location}\nGrids:\n{self.grids}\n" + "="*50
@@ -0,0 +1,83 @@
+"""
+Compiled versions of the State hot path (moving, collisions, rewards) for fast rollouts.
+Everything works on plain ints so numba can compile it; Actions stay in play.py.
+Grids are packed into 9-bit ints with grid_bits: bit (row * 3 + col) is set if that cell is blocked.
+"""
+
+import numpy as np
+from numba import njit
+
+# (delta row, delta col) of each action, in the same order as play.Action
+ACTION_DELTAS = np.array([[0,-1],[0,1],[-1,0],[1,0],[0,0]], np.int8)
+
+# collides specialized for the fixed 3x3 grid: for each location (row * 3 + col), the mask of
+# every cell a player there takes up. If the player is standing (not ducking or jumping), their
+# height is 2, so they also fill row 2. A player is standing if their row is 1 (jumping if 0, ducking if 2).
+COLLIDE_MASKS = np.array([(1 << (row * 3 + col)) | ((row == 1) << (2 * 3 + col))
+                          for row in range(3) for col in range(3)], np.int64)
+
+def grid_bits(grid:np.ndarray) -> int:
+    """Pack a 3x3 grid of 0/1 values into a 9-bit int, row-major"""
+    return int((grid.ravel().astype(np.uint16) << np.arange(9, dtype=np.uint16)).sum())
+
+@njit(cache=True)
+def update_loc(row:int, col:int, d_row:int, d_col:int) -> tuple[int,int]:
+    """Return the new (row, col) after a move, making sure they stay in bounds of 0 and 2"""
+    new_row = min(max(row + d_row, 0), 2)
+    new_col = min(max(col + d_col, 0), 2)
+    return new_row, new_col
+
+@njit(cache=True)
+def collides(bits:int, row:int, col:int) -> bool:
+    """Return whether a player at (row, col) hits a block in the packed grid"""
+    return (bits & COLLIDE_MASKS[row * 3 + col]) != 0
+
+@njit(cache=True)
+def get_reward(g0:int, g1:int | None, p_row:int, p_col:int, d_row:int, d_col:int) -> int:
+    """
+    Return the reward (0, 1, or 2) for the move (d_row, d_col) from (p_row, p_col).
+    g0 is the packed grid the move goes through, g1 the one after it (None at the end of the map).
+    """
+    row, col = update_loc(p_row, p_col, d_row, d_col)
+    # action results in immediate death --> no reward
+    if collides(g0, row, col):
+        return 0
+    # handle final grid of map
+    if g1 is None:
+        return 1
+    for i in range(len(ACTION_DELTAS)):
+        next_row, next_col = update_loc(row, col, ACTION_DELTAS[i, 0], ACTION_DELTAS[i, 1])
+        # any next move results in survival --> return 2
+        if not collides(g1, next_row, next_col):
+            return 2
+    return 1
+
+def _collides_batch(grids:np.ndarray, idx:np.ndarray, rows:np.ndarray, cols:np.ndarray) -> np.ndarray:
+    """collides for many players at once: grids[idx] is the (unpacked) grid each (row, col) is checked against"""
+    return (grids[idx, rows, cols] == 1) | ((rows == 1) & (grids[idx, 2, cols] == 1))
+
+def get_rewards(grids0:np.ndarray, grids1:np.ndarray | None, player_locations:np.ndarray,
+                deltas:np.ndarray) -> np.ndarray:
+    """
+    Vectorized get_reward for M states at once, with no Python loop over states.
+    Parameters:
+        grids0, grids1: (M, 3, 3) stacked grids of each state (grids1 None at the end of the map)
+        player_locations: (M, 2) (row, col) of each player
+        deltas: (M, 2) (delta row, delta col) of the action taken in each state
+    Returns:
+        (M,) rewards (0, 1, or 2)
+    """
+    states = np.arange(len(grids0))
+    locations = np.clip(player_locations + deltas, 0, 2)
+    # action results in immediate death --> no reward
+    survived = ~_collides_batch(grids0, states, locations[:, 0], locations[:, 1])
+    rewards = survived.astype(np.int64)
+    # handle final grid of map
+    if grids1 is None:
+        return rewards
+    # every state's 5 next locations, (M, 5, 2)
+    next_locations = np.clip(locations[:, None, :] + ACTION_DELTAS, 0, 2)
+    hits = _collides_batch(grids1, states[:, None], next_locations[..., 0], next_locations[..., 1])
+    # any next move results in survival --> return 2
+    rewards += survived & ~hits.all(axis=1)
+    return rewards